@@ -1,15 +1,68 @@
-from flask import Flask, request, send_file
+from flask import Flask, Request, request, send_file
 import cv2 as cv
 from PIL import Image, ImageSequence
 import numpy as np
+import atexit
 import io
+import itertools
+import os
+import shutil
+import stat
+import sys
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
 from flask_cors import CORS
+try:
+    import cvcuda
+    import torch
+except ImportError:
+    cvcuda = None
+try:
+    import av
+except ImportError:
+    av = None
+
+IMAGE_EXTENSIONS = (".jpeg", ".jpg", ".png")
+
+class ResizerRequest(Request):
+    # Werkzeug spools uploads over 500 KB to a temp file. Images are decoded
+    # straight from memory anyway, so keep them in RAM up to 32 MB instead of
+    # writing them to disk and reading them back.
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if filename and filename.lower().endswith(IMAGE_EXTENSIONS):
+            return tempfile.SpooledTemporaryFile(max_size=32 << 20, mode="rb+")
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
 app = Flask(__name__)
+app.request_class = ResizerRequest
 CORS(app)
 
+CUDA_AVAILABLE = hasattr(cv, "cuda") and cv.cuda.getCudaEnabledDeviceCount() > 0
+CVCUDA_AVAILABLE = cvcuda is not None and torch.cuda.is_available()
+# Private to this process (mode 0700), so other users on the host cannot
+# swap uploads or results out from under send_file.
+RESULT_DIR = tempfile.mkdtemp(prefix="resizer-")
+RESULT_TTL = 60 * 60
+atexit.register(shutil.rmtree, RESULT_DIR, ignore_errors=True)
+
+# Containers often export OMP_NUM_THREADS=1, which silently caps OpenCV's
+# thread pool. Ask for every core this process may run on (os.cpu_count()
+# would report the whole host) and report what the build supports.
+try:
+    CPU_COUNT = len(os.sched_getaffinity(0))
+except AttributeError:
+    CPU_COUNT = cv.getNumberOfCPUs()
+cv.setUseOptimized(True)
+cv.setNumThreads(CPU_COUNT)
+simd = [line.strip() for line in cv.getBuildInformation().splitlines()
+        if line.strip().startswith(("Baseline:", "Dispatched code generation:"))]
+print("OpenCV optimized : ", cv.useOptimized(), "\nOpenCV threads : ", cv.getNumThreads(), "\nOpenCV SIMD : ", simd)
+
 @app.route('/resize', methods=['POST'])
 def resize_media():
+    remove_expired_results()
     file = request.files['file']
     percentage = int(request.form['percentage'])
     ext = file.filename.split(".")[-1]
@@ -20,16 +73,18 @@ def resize_media():
     else:
         Interpolation = cv.INTER_AREA
     print("\n\nfile : ", file, "\npercentage : ", percentage,"\nExtentsion : ",ext,"\nInterpolation : ", Interpolation)
-    if file.filename.lower().endswith((".jpeg", ".jpg", ".png")):
+    # At 100% (downscale by 0 or upscale by 0) the upload is sent back as is
+    # instead of being decoded and re-encoded into an equivalent file.
+    if file.filename.lower().endswith(IMAGE_EXTENSIONS):
         mime_type = f"image/{ext}"
-        resized_file = resize_image(file, percentage, Interpolation)
+        resized_file = io.BytesIO(file.read()) if percentage == 100 else resize_image(file, percentage, Interpolation)
         return send_file(
             resized_file,
             mimetype=mime_type,
             as_attachment=True,
             download_name=file.filename)
     elif file.filename.lower().endswith((".mp4", ".mov", ".avi", ".mkv", ".3gp")):
-        resized_file = resize_video(file, percentage, Interpolation)
+        resized_file = passthrough_upload(file) if percentage == 100 else resize_video(file, percentage, Interpolation)
         mime_type = f"video/{ext}"
         return send_file(
             resized_file,
@@ -37,7 +92,7 @@ def resize_media():
             as_attachment=True,
             download_name=file.filename)
     elif file.filename.lower().endswith(".gif"):
-        resized_file = resize_gif(file, percentage, Interpolation)
+        resized_file = passthrough_upload(file) if percentage == 100 else resize_gif(file, percentage, Interpolation)
         return send_file(
             resized_file,
             mimetype='image/gif',
@@ -46,64 +101,251 @@ def resize_media():
     else:
         return 'Unsupported file format', 400
 
+def ensure_result_dir():
+    # A tmp cleaner may have removed the directory. Recreate it privately, and
+    # refuse to use one that someone else created under the same name.
+    try:
+        os.mkdir(RESULT_DIR, 0o700)
+    except FileExistsError:
+        st = os.lstat(RESULT_DIR)
+        if not stat.S_ISDIR(st.st_mode) or (os.name == "posix" and (st.st_uid != os.getuid() or st.st_mode & 0o077)):
+            raise RuntimeError(f"{RESULT_DIR} is not a private directory owned by this user")
+
+def remove_expired_results():
+    # Results are served straight from disk and send_file may still be reading
+    # them after the view returns, so they are swept once they pass the TTL.
+    ensure_result_dir()
+    cutoff = time.time() - RESULT_TTL
+    with os.scandir(RESULT_DIR) as entries:
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+def save_upload(input_stream, temp_file):
+    # Werkzeug spools uploads over 500 KB to a temp file of its own. On Linux,
+    # copy that file with os.sendfile so the data stays in the kernel instead
+    # of passing through Python buffers.
+    stream = input_stream.stream
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(0)
+    if sys.platform == "linux" and size > 1 << 20:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(temp_file.fileno(), stream.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    else:
+        input_stream.save(temp_file, buffer_size=1 << 20)
+
+def passthrough_upload(input_stream):
+    # Uploads are closed as soon as the view returns, before send_file has
+    # streamed anything, so the file is copied out next to the other results.
+    temp_file = tempfile.NamedTemporaryFile(delete=False, dir=RESULT_DIR)
+    save_upload(input_stream, temp_file)
+    temp_file.close()
+    return temp_file.name
+
 def resize_image(input_stream, percentage, Interpolation):
     ext = input_stream.filename.split(".")[-1]
     img = cv.imdecode(np.frombuffer(input_stream.read(), np.uint8), cv.IMREAD_UNCHANGED)
     new_width = int(img.shape[1] * (percentage / 100.0))
     new_height = int(img.shape[0] * (percentage / 100.0))
-    resized_frame = cv.resize(img, (new_width, new_height),  interpolation=Interpolation)
+    resized_frame = resize_frame(img, (new_width, new_height), Interpolation)
     print("\nOld Height : ",img.shape[0],"\nOld Width : ", img.shape[1])
     print("New Height : ",new_height,"\nNew Width : ", new_width)
+    if resized_frame.nbytes > 32 << 20:
+        # Large results are encoded straight to disk so send_file can serve
+        # them from the file instead of holding the encoded bytes in memory.
+        fd, output_path = tempfile.mkstemp(suffix='.'+ext, dir=RESULT_DIR)
+        os.close(fd)
+        cv.imwrite(output_path, resized_frame)
+        print("The image resized successfully")
+        return output_path
     _, buffer = cv.imencode('.'+ext, resized_frame)
     print("The image resized successfully")
     return io.BytesIO(buffer)
 
+def resize_frame(img, new_size, Interpolation):
+    crop_height, crop_width = area_fast_crop(img.shape[0], img.shape[1], new_size, Interpolation)
+    return cv.resize(img[:crop_height, :crop_width], new_size, interpolation=Interpolation)
+
+def area_fast_crop(height, width, new_size, Interpolation):
+    # INTER_AREA has an integer box-filter fast path for exact integer factors.
+    # Trimming the last few rows/columns left over by rounding (e.g. an odd
+    # width at 50%) lets common downscales hit it. Returns the source height
+    # and width to resize, so frame loops can compute it once.
+    new_width, new_height = new_size
+    if Interpolation == cv.INTER_AREA and 0 < new_width < width and 0 < new_height < height:
+        factor = width // new_width
+        crop_x, crop_y = width - factor * new_width, height - factor * new_height
+        if factor >= 2 and 0 <= crop_x < factor and 0 <= crop_y < factor and crop_x * 100 < width and crop_y * 100 < height:
+            return factor * new_height, factor * new_width
+    return height, width
+
 def resize_video(input_stream, percentage, Interpolation):
     ext = input_stream.filename.split(".")[-1]
-    temp_file = tempfile.NamedTemporaryFile(delete=False)
-    temp_file.write(input_stream.read())
+    temp_file = tempfile.NamedTemporaryFile(delete=False, dir=RESULT_DIR)
+    save_upload(input_stream, temp_file)
     temp_file.close()
-    cap = cv.VideoCapture(temp_file.name)
+    output_path = temp_file.name + "." + ext
+    try:
+        if av is not None and not CUDA_AVAILABLE and not CVCUDA_AVAILABLE:
+            try:
+                resize_video_av(temp_file.name, output_path, percentage, Interpolation)
+            except av.error.FFmpegError as e:
+                print("PyAV failed, falling back to OpenCV : ", e)
+                resize_video_cv(temp_file.name, output_path, percentage, Interpolation)
+        else:
+            resize_video_cv(temp_file.name, output_path, percentage, Interpolation)
+    finally:
+        os.remove(temp_file.name)
+    print("Video Resized Successfully!!!")
+    print("Output Path : ", output_path)
+    return output_path
+
+def resize_video_cv(input_path, output_path, percentage, Interpolation):
+    cap = cv.VideoCapture(input_path)
     fps = cap.get(cv.CAP_PROP_FPS)
     new_width = int(cap.get(cv.CAP_PROP_FRAME_WIDTH) * (percentage / 100.0))
     new_height = int(cap.get(cv.CAP_PROP_FRAME_HEIGHT) * (percentage / 100.0))
     fourcc = cv.VideoWriter_fourcc(*'mp4v')
-    output_stream = io.BytesIO()
-    out = cv.VideoWriter(temp_file.name +"."+ext, fourcc, fps, (new_width, new_height))
+    out = cv.VideoWriter(output_path, fourcc, fps, (new_width, new_height))
     fcount = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+    if CVCUDA_AVAILABLE:
+        resize_frames_cvcuda(cap, out, (new_width, new_height), Interpolation)
+    elif CUDA_AVAILABLE:
+        resize_frames_cuda(cap, out, (new_width, new_height), Interpolation)
+    else:
+        # Decode into and resize into the same two buffers for every frame
+        # instead of allocating a fresh pair per frame.
+        frame = None
+        resized_frame = np.empty((new_height, new_width, 3), np.uint8)
+        crop_height, crop_width = area_fast_crop(int(cap.get(cv.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv.CAP_PROP_FRAME_WIDTH)),
+                                                 (new_width, new_height), Interpolation)
+        while cap.isOpened():
+            ret, frame = cap.read(frame)
+            if not ret:
+                break
+            cv.resize(frame[:crop_height, :crop_width], (new_width, new_height), dst=resized_frame, interpolation=Interpolation)
+            out.write(resized_frame)
+    cap.release()
+    out.release()
+
+def resize_video_av(input_path, output_path, percentage, Interpolation):
+    # Decode, scale and encode inside FFmpeg so frames never go through NumPy.
+    # MPEG-4 Part 2 matches the 'mp4v' fourcc used by the OpenCV path, and
+    # yuv420p needs even dimensions. Frames are renumbered at a constant rate,
+    # as the OpenCV writer does, since variable-frame-rate timestamps can
+    # collide once rescaled into the encoder's time base.
+    with av.open(input_path) as in_container, av.open(output_path, "w") as out_container:
+        in_stream = in_container.streams.video[0]
+        in_stream.thread_type = "AUTO"
+        new_width = int(in_stream.codec_context.width * (percentage / 100.0)) // 2 * 2
+        new_height = int(in_stream.codec_context.height * (percentage / 100.0)) // 2 * 2
+        # mpeg4 rejects time bases with a denominator above 65535.
+        rate = (in_stream.average_rate or Fraction(30)).limit_denominator(1001)
+        out_stream = out_container.add_stream("mpeg4", rate=rate)
+        out_stream.width = new_width
+        out_stream.height = new_height
+        out_stream.pix_fmt = "yuv420p"
+        interpolation = "AREA" if Interpolation == cv.INTER_AREA else "BICUBIC"
+        for i, frame in enumerate(in_container.decode(in_stream)):
+            if i == 0 and frame.rotation:
+                # Phone videos are stored sideways with a display matrix; carry
+                # it over so players still show the result upright.
+                out_stream.set_display_rotation(frame.rotation)
+            frame = frame.reformat(width=new_width, height=new_height, format="yuv420p", interpolation=interpolation)
+            frame.pts = i
+            frame.time_base = 1 / rate
+            out_container.mux(out_stream.encode(frame))
+        out_container.mux(out_stream.encode())
+
+def resize_frames_cvcuda(cap, out, new_size, Interpolation, batch_size=32):
+    # Collect decoded frames into one NHWC buffer and resize each full batch
+    # with a single CV-CUDA call, so launch overhead is paid once per batch
+    # rather than once per frame. The last batch may be partial.
+    batch = None
+    count = 0
+    while cap.isOpened():
+        ret, frame = cap.read()
+        if ret:
+            if batch is None:
+                batch = np.empty((batch_size,) + frame.shape, frame.dtype)
+            batch[count] = frame
+            count += 1
+        if count and (count == batch_size or not ret):
+            for resized_frame in resize_batch_cvcuda(batch[:count], new_size, Interpolation):
+                out.write(resized_frame)
+            count = 0
+        if not ret:
+            break
+    print("Frames resized on GPU")
+
+def resize_frames_cuda(cap, out, new_size, Interpolation):
+    # Resize on the GPU into buffers that are allocated once and reused for
+    # every frame.
+    stream = cv.cuda.Stream()
+    gpu_frame = cv.cuda_GpuMat()
+    gpu_resized = cv.cuda_GpuMat(new_size[1], new_size[0], cv.CV_8UC3)
+    resized_frame = np.empty((new_size[1], new_size[0], 3), np.uint8)
     while cap.isOpened():
         ret, frame = cap.read()
         if not ret:
             break
-        resized_frame = cv.resize(frame, (new_width, new_height),interpolation=Interpolation)
+        gpu_frame.upload(frame, stream)
+        cv.cuda.resize(gpu_frame, new_size, dst=gpu_resized, interpolation=Interpolation, stream=stream)
+        gpu_resized.download(stream, resized_frame)
+        stream.waitForCompletion()
         out.write(resized_frame)
-        i = i + 1
-    cap.release()
-    out.release()
-    output_stream.write(open(temp_file.name+"."+ext, 'rb').read())
-    output_stream.seek(0)
-    print("Video Resized Successfully!!!")
-    print("Output Stream : ", output_stream)
-    return output_stream
+    print("Frames resized on GPU")
 
 def resize_gif(input_stream, percentage, Interpolation):
-    temp_file = tempfile.NamedTemporaryFile(delete=False)
-    temp_file.write(input_stream.read())
+    temp_file = tempfile.NamedTemporaryFile(delete=False, dir=RESULT_DIR)
+    save_upload(input_stream, temp_file)
     temp_file.close()
-    frames = []
-    img = Image.open(temp_file.name)
-    for frame in ImageSequence.Iterator(img):
-        frame = frame.convert("RGBA")
-        frame = cv.cvtColor(np.array(frame), cv.COLOR_RGBA2BGRA)
-        width, height = frame.shape[1], frame.shape[0]
-        new_width = int(width * (percentage / 100.0))
-        new_height = int(height * (percentage / 100.0))
-        resized_frame = cv.resize(frame, (new_width, new_height), interpolation=Interpolation)
-        frames.append(resized_frame)
-    frames_pil = [Image.fromarray(cv.cvtColor(frame, cv.COLOR_BGRA2RGBA)) for frame in frames]
-    frames_pil[0].save(temp_file.name,format="gif", save_all=True, append_images=frames_pil[1:], loop=0)
+    output_path = temp_file.name + ".gif"
+    try:
+        with Image.open(temp_file.name) as img:
+            new_width = int(img.width * (percentage / 100.0))
+            new_height = int(img.height * (percentage / 100.0))
+            if CVCUDA_AVAILABLE:
+                batch = np.stack([np.asarray(frame.convert("RGBA")) for frame in ImageSequence.Iterator(img)])
+                frames = resize_batch_cvcuda(batch, (new_width, new_height), Interpolation)
+            else:
+                # cv.resize is channel-agnostic, so frames stay RGBA end to end.
+                frames = resize_gif_frames(img, (new_width, new_height), Interpolation)
+            frames_pil = (Image.fromarray(frame) for frame in frames)
+            next(frames_pil).save(output_path, format="gif", save_all=True, append_images=frames_pil, loop=0)
+    finally:
+        os.remove(temp_file.name)
     print("The GIF resized successfully")
-    return temp_file.name
+    return output_path
+
+def resize_gif_frames(img, new_size, Interpolation):
+    # PIL has to decode the frames in order on one thread, but np.array and
+    # cv.resize release the GIL, so those run on a pool. Frames are handed out
+    # one window at a time so only a few full RGBA frames are alive at once.
+    window = CPU_COUNT
+    crop_height, crop_width = area_fast_crop(img.height, img.width, new_size, Interpolation)
+    frames = iter(ImageSequence.Iterator(img))
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        while True:
+            batch = [frame.convert("RGBA") for frame in itertools.islice(frames, window)]
+            if not batch:
+                break
+            yield from executor.map(lambda frame: cv.resize(np.asarray(frame)[:crop_height, :crop_width], new_size, interpolation=Interpolation), batch)
+
+def resize_batch_cvcuda(batch, new_size, Interpolation):
+    # Resize a whole NHWC uint8 batch with one CV-CUDA call instead of one
+    # cv.resize per frame. Resize is channel-agnostic, so RGBA goes in as is.
+    interp = cvcuda.Interp.AREA if Interpolation == cv.INTER_AREA else cvcuda.Interp.CUBIC
+    src = cvcuda.as_tensor(torch.from_numpy(batch).cuda(), "NHWC")
+    dst = cvcuda.resize(src, (batch.shape[0], new_size[1], new_size[0], batch.shape[3]), interp)
+    return torch.as_tensor(dst.cuda(), device="cuda").cpu().numpy()
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,18 @@
+# Production server for the resize API: gunicorn -c gunicorn.conf.py app:app
+#
+# app.run() is Flask's development server: a single process, so GIL-bound work
+# in one resize (PIL decoding, the Python frame loops) slows every other
+# request. Here each worker process handles several requests on threads;
+# cv.resize, PyAV and PIL release the GIL while they work, so threads keep the
+# cores busy, and a second process keeps the API responsive while the other
+# one is stuck in Python code.
+import os
+
+# Local only, like app.run(): the endpoint is unauthenticated and allows any
+# origin. Deployments that need it exposed pass --bind or GUNICORN_CMD_ARGS.
+bind = "127.0.0.1:5000"
+workers = max(2, (os.cpu_count() or 1) // 2)
+worker_class = "gthread"
+threads = 4
+# Large videos can take minutes to transcode.
+timeout = 600